@@ -64,7 +64,7 @@ from extractors.dell_invoice import (
     extract_table_from_text as extract_dell_table,
     DELL_INVOICE_COLS,
     PRE_ALERT_HEADERS,
-    build_pre_alert_rows,
+    build_pre_alert_rows_batch,
     read_master_mapping,
 )
 
@@ -1219,28 +1219,44 @@ elif tool == "💻 Dell Invoice Extractor":
             import os
             log_path = os.path.abspath('pdf_extract_debug.log')
             import tempfile
+            tmp_files = []
             for f in uploaded_files:
                 st.info(f"DEBUG: Processing file: {getattr(f, 'name', str(f))} (type: {type(f)})")
                 # Save UploadedFile to a temp file for processing
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                     tmp.write(f.read())
-                    tmp_path = tmp.name
+                    tmp_files.append((f, tmp.name))
+            master_kwargs = dict(
+                master_lookup=master_lookup,
+                supplier_counts=supplier_counts,
+                orion_counts=orion_counts,
+                supplier_index=supplier_index,
+                orion_index=orion_index,
+                po_price_index=po_price_index,
+            )
+            try:
+                # Invoices are independent, so large batches are parsed in parallel worker processes
                 try:
-                    rows = build_pre_alert_rows(
-                        tmp_path,
-                        tomorrow_date,
-                        master_lookup=master_lookup,
-                        supplier_counts=supplier_counts,
-                        orion_counts=orion_counts,
-                        supplier_index=supplier_index,
-                        orion_index=orion_index,
-                        po_price_index=po_price_index,
-                        diagnostics=diag,
+                    results = build_pre_alert_rows_batch(
+                        [tmp_path for _, tmp_path in tmp_files], tomorrow_date, **master_kwargs
                     )
-                    all_rows.extend(rows)
                 except Exception as e:
-                    st.warning(f"Failed to parse {getattr(f, 'name', 'file')}: {e}")
-                finally:
+                    # Pool failure other than a crashed worker (those PDFs come back as errors),
+                    # e.g. pickling or process start-up: redo the files one by one in-process
+                    st.warning(f"Parallel processing failed ({e}); processing files one at a time.")
+                    results = [
+                        build_pre_alert_rows_batch([tmp_path], tomorrow_date, **master_kwargs)[0]
+                        for _, tmp_path in tmp_files
+                    ]
+                for (f, _), (rows, file_diag, err) in zip(tmp_files, results):
+                    if err is not None:
+                        st.warning(f"Failed to parse {getattr(f, 'name', 'file')}: {err}")
+                        continue
+                    # diag[i] describes all_rows[i] (used for the highlights below)
+                    diag.extend(file_diag)
+                    all_rows.extend(rows)
+            finally:
+                for _, tmp_path in tmp_files:
                     try:
                         os.remove(tmp_path)
                     except Exception:
@@ -1,5 +1,17 @@
+import io
+import multiprocessing
+import os
 import re
-from typing import List, Optional, Dict, Any, Tuple
+import sys
+import threading
+import types
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import DefaultDict, Iterator, List, Optional, Dict, Any, Tuple
 
 import fitz  # PyMuPDF
 import pandas as pd
@@ -33,6 +45,186 @@ DELL_INVOICE_COLS = [
     "Amount",
 ]
 
+# Keyword sets for the item-table parsers. "subtotal" rows are covered by "total";
+# the skip test runs on the row text with dots removed, as normalize_line would.
+_SKIP_ROW_RE = re.compile(r"total|vat|tax")
+_ITEMS_HEADER_KEYWORDS = ("item no", "description", "quantity", "unit price")
+_ITEMS_END_PREFIXES = ("vat summary", "vat type")
+
+# Patterns are compiled once here and reused for every line/PDF processed.
+# Any label that extract_invoice_info reacts to; lets it skip unlabeled lines in one scan.
+_INVOICE_INFO_LABEL_RE = re.compile(r"invoice number|invoice no|invoice date|date:")
+_INVOICE_NUMBER_RE = re.compile(r"invoice\s+(?:number|no)\s*[:#-]?\s*([A-Za-z0-9-]+)")
+_INVOICE_DATE_LABEL_RE = re.compile(r"invoice\s+date\s*[:#-]?\s*([0-9]{1,2}[\-/ ][A-Za-z0-9]{3,}[\-/ ][0-9]{2,4})")
+_DATE_LABEL_RE = re.compile(r"\bdate\b\s*[:#-]?\s*([0-9]{1,2}[\-/ ][A-Za-z0-9]{3,}[\-/ ][0-9]{2,4})")
+# Example row:
+# 210-BMFF Dell Pro 24 Plus Monitor - P2425H 16 118.28 1,892.48 NL
+_ITEM_ROW_RE = re.compile(r"^([A-Z0-9-]+)\s+(.+?)\s+(\d{1,6})\s+([0-9,]+(?:\.[0-9]{2})?)\s+([0-9,]+(?:\.[0-9]{2})?)\s+[A-Z]{2}$")
+_ITEM_CODE_RE = re.compile(r"[A-Z0-9-]+")
+_AMOUNT_RE = re.compile(r"[0-9,]+(?:\.[0-9]{2})?")
+
+_HEADER_PO_NUMBER_RE = re.compile(r"your\s*ref\s*/\s*po\s*no\s*:\s*(?:PO)?\s*([A-Za-z0-9\-_/]+)", re.IGNORECASE)
+_HEADER_INVOICE_NUMBER_RE = re.compile(r"invoice\s*no\s*:\s*([A-Za-z0-9\-]+)", re.IGNORECASE)
+_HEADER_INVOICE_DATE_RE = re.compile(r"invoice\s*date\s*:\s*([0-9]{1,2}[\-/][0-9]{1,2}[\-/][0-9]{2,4}|[0-9]{1,2}\s+[A-Za-z]{3,}\s+[0-9]{4})", re.IGNORECASE)
+_HEADER_CUSTOMER_NO_RE = re.compile(r"customer\s*no\s*:\s*([A-Za-z0-9\-]+)", re.IGNORECASE)
+_HEADER_DELL_ORDER_NO_RE = re.compile(r"dell\s*order\s*no\s*:\s*([A-Za-z0-9\-]+)", re.IGNORECASE)
+_HEADER_SHIPPING_METHOD_RE = re.compile(r"shipping\s*method\s*:?[\s\n]*([A-Za-z0-9 \-–/]+)", re.IGNORECASE)
+_HEADER_ACCOUNT_TO_CHARGE_RE = re.compile(r"select\s+account\s+to\s+charge\s*:?[\s\n]*([A-Za-z0-9\-]+)", re.IGNORECASE)
+_HEADER_ED_ORDER_RE = re.compile(r"\bed\s*order\b\s*:?[\s\n]*([A-Za-z0-9\-]+)", re.IGNORECASE)
+# Single-pattern header fields, in extraction order (ed_order has a fallback pattern)
+_HEADER_FIELD_RES = (
+    ("po_number", _HEADER_PO_NUMBER_RE),
+    ("invoice_number", _HEADER_INVOICE_NUMBER_RE),
+    ("invoice_date", _HEADER_INVOICE_DATE_RE),
+    ("customer_no", _HEADER_CUSTOMER_NO_RE),
+    ("dell_order_no", _HEADER_DELL_ORDER_NO_RE),
+    ("shipping_method", _HEADER_SHIPPING_METHOD_RE),
+)
+_SOLUTION_NAME_RE = re.compile(r"solution\s*name\s*:", re.IGNORECASE)
+_SOLUTION_NAME_LABEL_RE = re.compile(r"(?i)solution\s*name\s*:\s*")
+_FUNDED_BY_RE = re.compile(r"^\s*funded\s+by\b", re.IGNORECASE)
+_DECIMAL_RE = re.compile(r"([0-9]+\.[0-9]{2})")
+
+_ITEM_CODE_LABEL_RE = re.compile(r"(?i)^item\s*code\s*[:\-]*\s*")
+_CODE_TOKEN_RE = re.compile(r"([A-Z0-9][A-Z0-9\-_]*[A-Z0-9])")
+
+
+def _match_item_row(line: str) -> Optional[Tuple[str, ...]]:
+    """Split a text-fallback item row into (item, desc, qty, unit, amount), or None.
+
+    Rows start with the item code and end in whitespace plus a 2-letter
+    country code, so any other line is rejected before matching. The trailing
+    qty/unit/amount/country fields are the last four tokens; they are taken
+    with one rsplit and checked token by token, and only lines that don't fit
+    that shape go through _ITEM_ROW_RE, whose lazy description group gets
+    slow on long descriptions. The result is always the regex's own.
+    """
+    # _ITEM_ROW_RE's "$" also matches before a single trailing newline
+    tail = line[:-1] if line.endswith("\n") else line
+    country = tail[-2:]
+    if not (
+        len(tail) >= 3 and not tail[0].isspace() and tail[-3].isspace()
+        and country.isascii() and country.isalpha() and country.isupper()
+    ):
+        return None
+    parts = tail.rsplit(None, 4)
+    if len(parts) == 5:
+        head, qty, unit, amt, _ = parts
+        item_desc = head.split(None, 1)
+        if (
+            len(item_desc) == 2
+            and "\n" not in item_desc[1]  # the regex's "." stops at newlines
+            and len(qty) <= 6 and qty.isdecimal()
+            and _ITEM_CODE_RE.fullmatch(item_desc[0])
+            and _AMOUNT_RE.fullmatch(unit)
+            and _AMOUNT_RE.fullmatch(amt)
+        ):
+            return item_desc[0], item_desc[1], qty, unit, amt
+    m = _ITEM_ROW_RE.match(line)
+    return m.groups() if m else None
+
+
+def _labeled_lines(text: str) -> Iterator[str]:
+    """Yield the lines of ``text`` that contain an invoice-info label, in order."""
+    last_start = -1
+    for hit in _INVOICE_INFO_LABEL_RE.finditer(text):
+        start = text.rfind("\n", 0, hit.start()) + 1
+        if start == last_start:
+            continue
+        last_start = start
+        end = text.find("\n", hit.end())
+        yield text[start:end] if end != -1 else text[start:]
+
+
+@dataclass
+class ParsedPdf:
+    """A Dell invoice PDF read once and shared by the extractors below.
+
+    The pdfplumber and PyMuPDF documents are opened from the in-memory bytes
+    on first use, and per-page text/tables are cached so that extracting the
+    header fields and the item table does not parse the same pages twice.
+    """
+
+    source: Any  # the path/stream it was read from, for logging
+    data: bytes = field(repr=False)
+    _plumber: Any = field(default=None, repr=False)
+    _doc: Any = field(default=None, repr=False)
+    _text: Dict[int, str] = field(default_factory=dict, repr=False)
+    _tables: Dict[int, List[List[List[Optional[str]]]]] = field(default_factory=dict, repr=False)
+    _doc_text: Dict[int, str] = field(default_factory=dict, repr=False)
+
+    @property
+    def plumber(self):
+        if self._plumber is None:
+            self._plumber = pdfplumber.open(io.BytesIO(self.data))
+        return self._plumber
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = fitz.open(stream=self.data, filetype="pdf")
+        return self._doc
+
+    @property
+    def page_count(self) -> int:
+        return len(self.plumber.pages)
+
+    def page_text(self, idx: int) -> str:
+        """pdfplumber text of page ``idx``."""
+        if idx not in self._text:
+            self._text[idx] = self.plumber.pages[idx].extract_text() or ""
+        return self._text[idx]
+
+    def page_tables(self, idx: int) -> List[List[List[Optional[str]]]]:
+        """pdfplumber tables of page ``idx`` ([] if extraction fails)."""
+        if idx not in self._tables:
+            try:
+                self._tables[idx] = self.plumber.pages[idx].extract_tables() or []
+            except Exception:
+                self._tables[idx] = []
+        return self._tables[idx]
+
+    def doc_page_text(self, idx: int) -> str:
+        """PyMuPDF text of page ``idx``."""
+        if idx not in self._doc_text:
+            self._doc_text[idx] = self.doc[idx].get_text("text")
+        return self._doc_text[idx]
+
+    def close(self) -> None:
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+
+@contextmanager
+def _parse_pdf(pdf_path) -> Iterator[ParsedPdf]:
+    """Yield a ParsedPdf for a path/stream; an existing ParsedPdf is passed through and left open."""
+    if isinstance(pdf_path, ParsedPdf):
+        yield pdf_path
+        return
+    if hasattr(pdf_path, "read"):
+        # Read the whole stream (like pdfplumber.open did) and leave its position as found
+        pos = None
+        if hasattr(pdf_path, "seek"):
+            pos = pdf_path.tell() if hasattr(pdf_path, "tell") else 0
+            pdf_path.seek(0)
+        try:
+            data = pdf_path.read()
+        finally:
+            if pos is not None:
+                pdf_path.seek(pos)
+        parsed = ParsedPdf(pdf_path, data)
+    else:
+        with open(pdf_path, "rb") as fh:
+            parsed = ParsedPdf(pdf_path, fh.read())
+    try:
+        yield parsed
+    finally:
+        parsed.close()
+
 
 def extract_invoice_info(pdf_path) -> tuple[Optional[str], Optional[str]]:
     """Extract Invoice Number and Invoice Date from a Dell invoice PDF.
@@ -42,55 +234,51 @@ def extract_invoice_info(pdf_path) -> tuple[Optional[str], Optional[str]]:
     invoice_number: Optional[str] = None
     invoice_date: Optional[str] = None
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages[:2]:  # Typically on first page
-            text = page.extract_text() or ""
-            for raw in text.splitlines():
-                line = normalize_line(raw)
+    with _parse_pdf(pdf_path) as pdf:
+        for page_idx in range(min(pdf.page_count, 2)):  # Typically on first page
+            text = pdf.page_text(page_idx)
+            norm_text = "\n".join(normalize_line(raw) for raw in text.splitlines())
+            for line in _labeled_lines(norm_text):
                 if invoice_number is None and ("invoice number" in line or "invoice no" in line):
-                    m = re.search(r"invoice\s+(?:number|no)\s*[:#-]?\s*([A-Za-z0-9-]+)", line)
+                    m = _INVOICE_NUMBER_RE.search(line)
                     if m:
                         invoice_number = m.group(1)
                 if invoice_date is None and ("invoice date" in line or "date:" in line):
-                    m = re.search(r"invoice\s+date\s*[:#-]?\s*([0-9]{1,2}[\-/ ][A-Za-z0-9]{3,}[\-/ ][0-9]{2,4})", line)
+                    m = _INVOICE_DATE_LABEL_RE.search(line)
                     if not m:
-                        m = re.search(r"\bdate\b\s*[:#-]?\s*([0-9]{1,2}[\-/ ][A-Za-z0-9]{3,}[\-/ ][0-9]{2,4})", line)
+                        m = _DATE_LABEL_RE.search(line)
                     if m:
                         invoice_date = m.group(1)
+                if invoice_number and invoice_date:
+                    break
             if invoice_number and invoice_date:
                 break
     return invoice_number, invoice_date
 
 
-def _normalize_headers(headers: List[str]) -> List[str]:
-    return [normalize_line(h).lower() for h in headers]
-
-
 def _find_dell_items_table(table: List[List[Optional[str]]]) -> Optional[dict]:
     """Given a raw table (list of rows), detect a header row with item columns.
 
     Returns a mapping of column indices if detected, else None.
     """
     for ridx, row in enumerate(table):
-        headers = [str(c or "").strip() for c in row]
-        norm = _normalize_headers(headers)
-        has_desc = any("description" in c for c in norm)
-        has_qty = any(("qty" in c) or ("quantity" in c) for c in norm)
-        has_unit_price = any("unit price" in c or ("price" == c) for c in norm)
-        has_amount = any("amount" in c or "total" in c for c in norm)
-        if has_desc and has_qty and has_unit_price and has_amount:
-            # Build column index mapping
-            def idx_of(pred) -> int:
-                for i, c in enumerate(norm):
-                    if pred(c):
-                        return i
-                return -1
-
+        # First column matching each header, found in one walk over the row
+        # that stops (and stops normalizing cells) once all four are known
+        idx_desc = idx_qty = idx_unit = idx_amt = -1
+        for i, cell in enumerate(row):
+            c = normalize_line(str(cell or "")).lower()
+            if idx_desc < 0 and "description" in c:
+                idx_desc = i
+            if idx_qty < 0 and (("qty" in c) or ("quantity" in c)):
+                idx_qty = i
+            if idx_unit < 0 and ("unit price" in c or c == "price"):
+                idx_unit = i
+            if idx_amt < 0 and ("amount" in c or "total" in c):
+                idx_amt = i
+            if idx_desc >= 0 and idx_qty >= 0 and idx_unit >= 0 and idx_amt >= 0:
+                break
+        if idx_desc >= 0 and idx_qty >= 0 and idx_unit >= 0 and idx_amt >= 0:
             idx_item = 0  # Usually first column is item/SKU
-            idx_desc = idx_of(lambda c: "description" in c)
-            idx_qty = idx_of(lambda c: ("qty" in c) or ("quantity" in c))
-            idx_unit = idx_of(lambda c: "unit price" in c or c == "price")
-            idx_amt = idx_of(lambda c: "amount" in c or "total" in c)
             return {
                 "header_row": ridx,
                 "idx_item": idx_item,
@@ -102,69 +290,93 @@ def _find_dell_items_table(table: List[List[Optional[str]]]) -> Optional[dict]:
     return None
 
 
-def extract_table_from_text(pdf_path) -> List[List[str]]:
-    """Extract Dell invoice items as rows aligned to DELL_INVOICE_COLS.
+def iter_table_rows(pdf_path) -> Iterator[Tuple[str, str, str, str, str]]:
+    """Yield Dell invoice items as (item, desc, qty, unit, amount) tuples.
 
     Uses pdfplumber's table extraction and a heuristic header detector.
+    Pages are parsed as rows are consumed; pages after the one where the
+    text fallback reaches the end of the items section (VAT Summary/VAT
+    Type) are not parsed.
     """
-    rows: List[List[str]] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
+    found = False
+    items_done = False
+    with _parse_pdf(pdf_path) as pdf:
+        for page_idx in range(pdf.page_count):
+            if items_done:
+                break
             used_fallback = False
-            try:
-                raw_tables = page.extract_tables() or []
-            except Exception:
-                raw_tables = []
+            raw_tables = pdf.page_tables(page_idx)
             for table in raw_tables:
                 mapping = _find_dell_items_table(table)
                 if not mapping:
                     continue
                 start = mapping["header_row"] + 1
+                col_idx = (mapping["idx_item"], mapping["idx_desc"], mapping["idx_qty"], mapping["idx_unit"], mapping["idx_amt"])
                 for r in table[start:]:
-                    if not any((c is not None and str(c).strip() != "") for c in r):
+                    cells = ["" if c is None else str(c).strip() for c in r]
+                    if not any(cells):
                         continue
-                    def safe(idx: int) -> str:
-                        if idx < 0 or idx >= len(r):
-                            return ""
-                        v = r[idx]
-                        return str(v).strip() if v is not None else ""
-
-                    item = safe(mapping["idx_item"]) if mapping["idx_item"] >= 0 else ""
-                    desc = safe(mapping["idx_desc"]) if mapping["idx_desc"] >= 0 else ""
-                    qty = safe(mapping["idx_qty"]) if mapping["idx_qty"] >= 0 else ""
-                    unit = safe(mapping["idx_unit"]) if mapping["idx_unit"] >= 0 else ""
-                    amt = safe(mapping["idx_amt"]) if mapping["idx_amt"] >= 0 else ""
+                    item, desc, qty, unit, amt = [cells[i] if 0 <= i < len(cells) else "" for i in col_idx]
 
                     # Skip subtotal/total rows
-                    line_norm = normalize_line(" ".join([desc, qty, unit, amt]))
-                    if any(k in line_norm for k in ["subtotal", "total", "vat", "tax"]):
+                    if _SKIP_ROW_RE.search(" ".join((desc, qty, unit, amt)).replace(".", "")):
                         continue
 
-                    rows.append([item, desc, qty, unit, amt])
+                    found = True
+                    yield item, desc, qty, unit, amt
 
             # Fallback: parse from plain text between header and VAT Summary
-            if not raw_tables or not rows:
-                text = page.extract_text() or ""
+            if not raw_tables or not found:
+                text = pdf.page_text(page_idx)
                 if not text:
                     continue
-                lines = [l.strip() for l in text.splitlines() if l.strip()]
+                lines = [l for l in (raw.strip() for raw in text.splitlines()) if l]
                 in_items = False
                 for line in lines:
                     raw_line = line
                     ln_low = normalize_line(line).lower()
-                    if not in_items and ("item no" in ln_low and "description" in ln_low and "quantity" in ln_low and "unit price" in ln_low):
+                    if not in_items and all(k in ln_low for k in _ITEMS_HEADER_KEYWORDS):
                         in_items = True
                         continue
-                    if in_items and (ln_low.startswith("vat summary") or ln_low.startswith("vat type")):
+                    if in_items and ln_low.startswith(_ITEMS_END_PREFIXES):
+                        items_done = found
                         break
                     if in_items:
-                        # Example row:
-                        # 210-BMFF Dell Pro 24 Plus Monitor - P2425H 16 118.28 1,892.48 NL
-                        m = re.match(r"^([A-Z0-9-]+)\s+(.+?)\s+(\d{1,6})\s+([0-9,]+(?:\.[0-9]{2})?)\s+([0-9,]+(?:\.[0-9]{2})?)\s+[A-Z]{2}$", raw_line)
+                        m = _match_item_row(raw_line)
                         if m:
-                            item, desc, qty, unit, amt = m.groups()
-                            rows.append([item, desc, qty, unit, amt])
-    return rows
+                            found = True
+                            yield m
+
+
+def extract_table_from_text(pdf_path) -> List[List[str]]:
+    """Extract Dell invoice items as rows aligned to DELL_INVOICE_COLS."""
+    return [list(r) for r in iter_table_rows(pdf_path)]
+
+
+def _first_page_has_all_header_fields(full_text: str, raw_lines: List[str]) -> bool:
+    """True if page 1 alone yields every field extract_header_fields looks for.
+
+    Page 2 can then not change the result: every field pattern already has a
+    non-blank match, and the consolidation line has its whole lookahead (and
+    10-line debug window) on this page with a decimal to pick.
+    """
+    for _, pattern in _HEADER_FIELD_RES:
+        m = pattern.search(full_text)
+        if not (m and m.group(1).strip()):
+            return False
+    m = _HEADER_ACCOUNT_TO_CHARGE_RE.search(full_text) or _HEADER_ED_ORDER_RE.search(full_text)
+    if not (m and m.group(1).strip()):
+        return False
+    # A trailing blank line is dropped by extract_header_fields if no page follows
+    n_lines = len(raw_lines) - (1 if raw_lines and not raw_lines[-1] else 0)
+    for i, line in enumerate(raw_lines):
+        pos = line.lower().find("consolidation")
+        if pos >= 0:
+            if n_lines - i <= 10:
+                return False
+            post = line[pos + len("consolidation"):]
+            return any(_DECIMAL_RE.search(s) for s in [post] + raw_lines[i + 1:i + 5])
+    return False
 
 
 def extract_header_fields(pdf_path) -> Dict[str, Any]:
@@ -184,94 +396,87 @@ def extract_header_fields(pdf_path) -> Dict[str, Any]:
         "consolidation_fee_usd": "",
     }
 
-    def capture_after(label: str, line: str) -> Optional[str]:
-        m = re.search(rf"{label}\s*[:#-]?\s*(.+)$", line)
-        return m.group(1).strip() if m else None
-
-    doc = fitz.open(pdf_path)
-    full_text_parts: List[str] = []
-    raw_text_parts: List[str] = []
-    for page in doc:
-        t = page.get_text("text")
-        if t:
-            lines = [normalize_line(x) for x in t.splitlines()]
-            full_text_parts.append("\n".join(lines))
-            raw_text_parts.append("\n".join([x.strip() for x in t.splitlines()]))
-        if len(full_text_parts) >= 2:
-            break
-    full_text = "\n".join(full_text_parts)
-    raw_full_text = "\n".join(raw_text_parts)
+    norm_lines: List[str] = []
+    raw_lines: List[str] = []
+    pages_read = 0
+    with _parse_pdf(pdf_path) as pdf:
+        source = pdf.source
+        for page_idx in range(pdf.doc.page_count):
+            t = pdf.doc_page_text(page_idx)
+            if t:
+                page_lines = t.splitlines()
+                norm_lines.extend(normalize_line(x) for x in page_lines)
+                raw_lines.extend(x.strip() for x in page_lines)
+                pages_read += 1
+            if pages_read >= 2:
+                break
+            if pages_read == 1 and _first_page_has_all_header_fields("\n".join(norm_lines), raw_lines):
+                break
+    full_text = "\n".join(norm_lines)
+    # Same lines the old join/splitlines round trip gave: no trailing blank line
+    if raw_lines and not raw_lines[-1]:
+        raw_lines.pop()
 
-    def get(pattern: str) -> Optional[str]:
-        m = re.search(pattern, full_text, flags=re.IGNORECASE)
+    def get(pattern: "re.Pattern[str]") -> Optional[str]:
+        m = pattern.search(full_text)
         return m.group(1).strip() if m else None
 
-    out["po_number"] = get(r"your\s*ref\s*/\s*po\s*no\s*:\s*(?:PO)?\s*([A-Za-z0-9\-_/]+)") or out["po_number"]
-    out["invoice_number"] = get(r"invoice\s*no\s*:\s*([A-Za-z0-9\-]+)") or out["invoice_number"]
-    out["invoice_date"] = get(r"invoice\s*date\s*:\s*([0-9]{1,2}[\-/][0-9]{1,2}[\-/][0-9]{2,4}|[0-9]{1,2}\s+[A-Za-z]{3,}\s+[0-9]{4})") or out["invoice_date"]
-    out["customer_no"] = get(r"customer\s*no\s*:\s*([A-Za-z0-9\-]+)") or out["customer_no"]
-    out["dell_order_no"] = get(r"dell\s*order\s*no\s*:\s*([A-Za-z0-9\-]+)") or out["dell_order_no"]
-    out["shipping_method"] = get(r"shipping\s*method\s*:?[\s\n]*([A-Za-z0-9 \-–/]+)") or out["shipping_method"]
+    for key, pattern in _HEADER_FIELD_RES:
+        out[key] = get(pattern) or out[key]
     if not out["shipping_method"]:
             # Fallback: capture block from 'Solution Name' down to before 'Funded By'
-            raw_lines = raw_full_text.splitlines()
-            start_idx = next((i for i, l in enumerate(raw_lines) if re.search(r"solution\s*name\s*:", l, re.IGNORECASE)), None)
-            end_idx = next((i for i, l in enumerate(raw_lines) if i > (start_idx or -1) and re.search(r"^\s*funded\s+by\b", l, re.IGNORECASE)), None)
+            start_idx = next((i for i, l in enumerate(raw_lines) if _SOLUTION_NAME_RE.search(l)), None)
+            end_idx = next((i for i, l in enumerate(raw_lines) if i > (start_idx or -1) and _FUNDED_BY_RE.search(l)), None)
             if start_idx is not None:
                 block = raw_lines[start_idx:(end_idx if end_idx is not None else start_idx + 6)]
                 # Remove the 'Solution Name:' label on the first line
                 if block:
-                    block[0] = re.sub(r"(?i)solution\s*name\s*:\s*", "", block[0]).strip()
+                    block[0] = _SOLUTION_NAME_LABEL_RE.sub("", block[0]).strip()
                 # Join non-empty lines as AWB text
                 joined = " ".join([b.strip() for b in block if b.strip()])
                 out["shipping_method"] = joined
     out["ed_order"] = (
-            get(r"select\s+account\s+to\s+charge\s*:?[\s\n]*([A-Za-z0-9\-]+)")
-            or get(r"\bed\s*order\b\s*:?[\s\n]*([A-Za-z0-9\-]+)")
+            get(_HEADER_ACCOUNT_TO_CHARGE_RE)
+            or get(_HEADER_ED_ORDER_RE)
             or out["ed_order"]
         )
 
         # Consolidation (currency-agnostic): pick last numeric on consolidation line
-    raw_lines = raw_full_text.splitlines()
     for i, line in enumerate(raw_lines):
-            ln = line.lower()
-            if "consolidation" in ln:
-                try:
-                    post = line[ln.index("consolidation") + len("consolidation"):]
-                except Exception:
-                    post = ""
-                def nums_in(s: str) -> List[str]:
-                    return re.findall(r"([0-9]+\.[0-9]{2})", s)
-                nums_post = nums_in(post)
-                logger.info(f"[PDF DEBUG] Consolidation line: {line}")
-                logger.info(f"[PDF DEBUG] Numbers after 'consolidation': {nums_post}")
-                # Log the next 10 lines after 'Consolidation' for full debug
-                debug_lines = []
-                for k in range(1, 11):
-                    if i + k < len(raw_lines):
-                        debug_lines.append(raw_lines[i + k])
-                logger.info(f"[PDF DEBUG] Next 10 lines after 'Consolidation': {debug_lines}")
-                for idx, dbg_line in enumerate(debug_lines):
-                    nums_dbg = nums_in(dbg_line)
-                    logger.info(f"[PDF DEBUG] Line {i+1+idx}: {dbg_line} | Decimals: {nums_dbg}")
-                lookahead = debug_lines[:4]
-                all_nums: List[str] = nums_post[:]
-                for la in lookahead:
-                    all_nums += nums_in(la)
-                logger.info(f"[PDF DEBUG] Lookahead lines (first 4): {lookahead}")
-                logger.info(f"[PDF DEBUG] All decimal numbers in lookahead: {all_nums}")
-                for handler in logger.handlers:
-                    handler.flush()
-                if all_nums:
-                    candidate = max(all_nums, key=lambda x: float(x))
-                    logger.info(f"[PDF DEBUG] Picked largest candidate for consolidation_fee_usd: {candidate}")
-                    out["consolidation_fee_usd"] = candidate
-                    logger.info(f"[PDF DEBUG] Consolidation fee extracted for {pdf_path}: {candidate}")
-                else:
-                    logger.info(f"[PDF DEBUG] No consolidation fee candidate found for {pdf_path}")
-                for handler in logger.handlers:
-                    handler.flush()
-                break
+            pos = line.lower().find("consolidation")
+            if pos < 0:
+                continue
+            post = line[pos + len("consolidation"):]
+            nums_post = _DECIMAL_RE.findall(post)
+            logger.info(f"[PDF DEBUG] Consolidation line: {line}")
+            logger.info(f"[PDF DEBUG] Numbers after 'consolidation': {nums_post}")
+            # Log the next 10 lines after 'Consolidation' for full debug
+            debug_lines = []
+            for k in range(1, 11):
+                if i + k < len(raw_lines):
+                    debug_lines.append(raw_lines[i + k])
+            logger.info(f"[PDF DEBUG] Next 10 lines after 'Consolidation': {debug_lines}")
+            debug_nums = [_DECIMAL_RE.findall(dbg_line) for dbg_line in debug_lines]
+            for idx, dbg_line in enumerate(debug_lines):
+                logger.info(f"[PDF DEBUG] Line {i+1+idx}: {dbg_line} | Decimals: {debug_nums[idx]}")
+            lookahead = debug_lines[:4]
+            all_nums: List[str] = nums_post[:]
+            for nums_la in debug_nums[:4]:
+                all_nums += nums_la
+            logger.info(f"[PDF DEBUG] Lookahead lines (first 4): {lookahead}")
+            logger.info(f"[PDF DEBUG] All decimal numbers in lookahead: {all_nums}")
+            for handler in logger.handlers:
+                handler.flush()
+            if all_nums:
+                candidate = max(all_nums, key=lambda x: float(x))
+                logger.info(f"[PDF DEBUG] Picked largest candidate for consolidation_fee_usd: {candidate}")
+                out["consolidation_fee_usd"] = candidate
+                logger.info(f"[PDF DEBUG] Consolidation fee extracted for {source}: {candidate}")
+            else:
+                logger.info(f"[PDF DEBUG] No consolidation fee candidate found for {source}")
+            for handler in logger.handlers:
+                handler.flush()
+            break
 
     return out
 
@@ -307,7 +512,9 @@ PRE_ALERT_HEADERS = [
 
 def _normalize_po(po: str) -> str:
     s = str(po or "").strip()
-    s = re.sub(r"(?i)^po\s*", "", s)
+    # Drop a leading "PO" (any case) and the whitespace after it
+    if s[:2].lower() == "po":
+        s = s[2:].lstrip()
     return s
 
 def _normalize_item_code(raw: str) -> str:
@@ -318,13 +525,65 @@ def _normalize_item_code(raw: str) -> str:
     - Extract the first token that looks like A-Z/0-9 with dashes/underscores
     """
     s = str(raw or "").strip().upper()
-    # Common label removal
-    s = re.sub(r"(?i)^item\s*code\s*[:\-]*\s*", "", s)
+    # Common label removal; only an "?TEM..." prefix can match (re's IGNORECASE
+    # also lets U+0130 stand in for the I, so that is not checked here)
+    if s.startswith("TEM", 1):
+        s = _ITEM_CODE_LABEL_RE.sub("", s)
+    # Already a single clean code: the token search would return it unchanged
+    if (
+        len(s) >= 2 and s.isascii()
+        and s[0].isalnum() and s[-1].isalnum()
+        and s.replace("-", "").replace("_", "").isalnum()
+    ):
+        return s
     # Take first code-like token
-    m = re.search(r"([A-Z0-9][A-Z0-9\-_]*[A-Z0-9])", s)
+    m = _CODE_TOKEN_RE.search(s)
     return m.group(1) if m else s
 
 
+def _po_flex_match(master_po: str, pdf_po: str) -> bool:
+    return bool(master_po) and bool(pdf_po) and (master_po.startswith(pdf_po) or pdf_po.startswith(master_po))
+
+
+class _FlexSupplierIndex:
+    """supplier_index entries whose PO flex-matches one PDF's PO, searchable by item code.
+
+    match() returns the entries whose supplier code is a prefix of the item code
+    or starts with it, in supplier_index order -- the same result as scanning
+    every (po, supplier) key, without touching the other POs' keys per item.
+    """
+
+    def __init__(self, supplier_index: Dict[Tuple[str, str], List[Tuple[str, str, str, str]]], po_key: str):
+        self._entries: List[List[Tuple[str, str, str, str]]] = []
+        self._by_code: Dict[str, List[int]] = {}
+        for (kpo, ksupp), entries in supplier_index.items():
+            if _po_flex_match(kpo, po_key):
+                self._by_code.setdefault(ksupp, []).append(len(self._entries))
+                self._entries.append(entries)
+        self._codes = sorted(self._by_code)
+
+    def match(self, item_code: str) -> List[Tuple[str, str, str, str]]:
+        hits = set()
+        # Supplier codes that are a prefix of the item code
+        for end in range(len(item_code) + 1):
+            hits.update(self._by_code.get(item_code[:end], ()))
+        # Supplier codes that start with the item code (contiguous once sorted)
+        i = bisect_left(self._codes, item_code)
+        while i < len(self._codes) and self._codes[i].startswith(item_code):
+            hits.update(self._by_code[self._codes[i]])
+            i += 1
+        out: List[Tuple[str, str, str, str]] = []
+        for pos in sorted(hits):
+            out.extend(self._entries[pos])
+        return out
+
+
+# Lowercased master headers read_master_mapping looks up (required and optional)
+_MASTER_COLUMNS = frozenset(
+    ("po num", "supplier item code", "orion item code", "pi item desc", "po unit rate", "qty", "po qty")
+)
+
+
 def read_master_mapping(path_or_stream) -> Tuple[
     Dict[Tuple[str, str], Tuple[str, str]],
     Dict[Tuple[str, str], int],
@@ -338,7 +597,13 @@ def read_master_mapping(path_or_stream) -> Tuple[
     Key: (Po Num normalized without 'PO', Supplier Item Code)
     Value: (Orion Item Code, Pi Item Desc)
     """
-    df = pd.read_excel(path_or_stream, header=8, dtype=str)
+    # Only the mapping columns are converted; masters carry many unrelated ones
+    df = pd.read_excel(
+        path_or_stream,
+        header=8,
+        dtype=str,
+        usecols=lambda c: str(c).strip().lower() in _MASTER_COLUMNS,
+    )
     def col(name: str) -> str:
         for c in df.columns:
             if str(c).strip().lower() == name.lower():
@@ -363,30 +628,42 @@ def read_master_mapping(path_or_stream) -> Tuple[
             c_qty = None
 
     lookup: Dict[Tuple[str, str], Tuple[str, str]] = {}
-    supplier_counts: Dict[Tuple[str, str], int] = {}
-    orion_counts: Dict[Tuple[str, str], int] = {}
-    supplier_index: Dict[Tuple[str, str], List[Tuple[str, str, str, str]]] = {}
-    orion_index: Dict[Tuple[str, str], List[Tuple[str, str, str, str]]] = {}
-    po_price_index: Dict[str, List[Tuple[str, str, str, str, str]]] = {}
-    for _, r in df.iterrows():
-        po = _normalize_po(r.get(c_po, ""))
-        supp = _normalize_item_code(r.get(c_supplier, ""))
-        orion = str(r.get(c_orion, "") or "").strip()
-        pi_desc = str(r.get(c_pi_desc, "") or "").strip()
-        unit_rate = str(r.get(c_unit_rate, "") or "").strip() if c_unit_rate else ""
-        qty = str(r.get(c_qty, "") or "").strip() if c_qty else ""
+    supplier_counts: Counter = Counter()
+    orion_counts: Counter = Counter()
+    supplier_index: DefaultDict[Tuple[str, str], List[Tuple[str, str, str, str]]] = defaultdict(list)
+    orion_index: DefaultDict[Tuple[str, str], List[Tuple[str, str, str, str]]] = defaultdict(list)
+    po_price_index: DefaultDict[str, List[Tuple[str, str, str, str, str]]] = defaultdict(list)
+
+    def values(c: Optional[str]) -> List[str]:
+        # Whole column as stripped strings, without materializing a Series per row
+        if c is None:
+            return [""] * len(df)
+        return [str(v or "").strip() for v in df[c].tolist()]
+
+    # The same POs and codes repeat across many master rows, so each distinct
+    # value is normalized once
+    po_vals, supp_vals, orions = values(c_po), values(c_supplier), values(c_orion)
+    po_norm = {v: _normalize_po(v) for v in set(po_vals)}
+    supp_norm = {v: _normalize_item_code(v) for v in set(supp_vals)}
+    orion_norm = {v: _normalize_item_code(v) for v in set(orions)}
+    pos = [po_norm[v] for v in po_vals]
+    supps = [supp_norm[v] for v in supp_vals]
+    for po, supp, orion, pi_desc, unit_rate, qty in zip(
+        pos, supps, orions, values(c_pi_desc), values(c_unit_rate), values(c_qty)
+    ):
         if po and supp:
             key = (po, supp)
             lookup[key] = (orion, pi_desc)
-            supplier_counts[key] = supplier_counts.get(key, 0) + 1
-            supplier_index.setdefault(key, []).append((orion, pi_desc, unit_rate, qty))
+            supplier_counts[key] += 1
+            supplier_index[key].append((orion, pi_desc, unit_rate, qty))
         if po and orion:
-            okey = (po, _normalize_item_code(orion))
-            orion_counts[okey] = orion_counts.get(okey, 0) + 1
-            orion_index.setdefault(okey, []).append((orion, pi_desc, unit_rate, qty))
+            okey = (po, orion_norm[orion])
+            orion_counts[okey] += 1
+            orion_index[okey].append((orion, pi_desc, unit_rate, qty))
         if po:
-            po_price_index.setdefault(po, []).append((orion, pi_desc, unit_rate, qty, supp))
-    return lookup, supplier_counts, orion_counts, supplier_index, orion_index, po_price_index
+            po_price_index[po].append((orion, pi_desc, unit_rate, qty, supp))
+    # Plain dicts out, so callers' lookups can't insert empty entries
+    return lookup, supplier_counts, orion_counts, dict(supplier_index), dict(orion_index), dict(po_price_index)
 
 
 def build_pre_alert_rows(
@@ -403,294 +680,445 @@ def build_pre_alert_rows(
     """Build rows for the PRE ALERT UPLOAD sheet from a single PDF.
     Enhanced heavy debug/logging version.
     """
-    headers = extract_header_fields(pdf_path)
-    items = extract_table_from_text(pdf_path)
-    rows: List[List[Any]] = []
-
-    for idx_item, item in enumerate(items):
-        debug_steps: List[str] = []
-        try:
-            debug_steps.append(f"Processing item index={idx_item} raw_item={item!r}")
-            item_no = item[0] if len(item) > 0 else ""
-            item_no_norm = _normalize_item_code(item_no)
-            desc = item[1] if len(item) > 1 else ""
-            qty = item[2] if len(item) > 2 else ""
-            unit_price = item[3] if len(item) > 3 else ""
-            debug_steps.append(f"Normalized item code: '{item_no_norm}' desc='{desc}' qty='{qty}' unit_price='{unit_price}'")
-
-            mapped_item_code = ""
-            mapped_item_desc = ""
-            out_orion_unit_price = ""
-            out_orion_qty = ""
-            out_orion_item_code = ""
-            matched_by = "none"
-            chosen_orion_code_minimal = ""
-            highlight = "none"
-            status = ""
-
-            if master_lookup:
-                po_key = _normalize_po(headers.get("po_number", ""))
-                key = (po_key, item_no_norm)
-                debug_steps.append(f"PO key='{po_key}', lookup key={key!r}")
-
-                def as_float(s: str) -> Optional[float]:
+    with _parse_pdf(pdf_path) as pdf:
+        headers = extract_header_fields(pdf)
+        rows: List[List[Any]] = []
+        # Header-derived values are the same for every item of the invoice
+        header_po_key = _normalize_po(headers.get("po_number", ""))
+        consolidation_fee = headers.get("consolidation_fee_usd", "")
+        row_head = [
+            "PO",  # PO Txn Code
+            headers.get("po_number", ""),
+            headers.get("dell_order_no", ""),
+            headers.get("invoice_date", ""),
+            headers.get("customer_no", "") or headers.get("ed_order", "") or headers.get("dell_order_no", ""),
+            ""  ,# AWB per spec
+               today_plus_10,  # Bill of leading date
+            "N/A",  # Shipping Agent
+            "N/A",  # From Port
+            "N/A",  # To Port
+               today_plus_10,  # ETS
+               today_plus_10,  # ETA (kept the same as ETS)
+        ]
+        flex_index = None
+        if master_lookup and supplier_index:
+            flex_index = _FlexSupplierIndex(supplier_index, header_po_key)
+
+        # Items are streamed; the PDF stays open until the last row is built
+        for idx_item, item in enumerate(iter_table_rows(pdf)):
+            item_no, desc, qty, unit_price, _amt = item
+            debug_steps: List[str] = []
+            try:
+                debug_steps.append(f"Processing item index={idx_item} raw_item={list(item)!r}")
+                item_no_norm = _normalize_item_code(item_no)
+                debug_steps.append(f"Normalized item code: '{item_no_norm}' desc='{desc}' qty='{qty}' unit_price='{unit_price}'")
+
+                mapped_item_code = ""
+                mapped_item_desc = ""
+                out_orion_unit_price = ""
+                out_orion_qty = ""
+                out_orion_item_code = ""
+                matched_by = "none"
+                chosen_orion_code_minimal = ""
+                highlight = "none"
+                status = ""
+
+                if master_lookup:
+                    po_key = header_po_key
+                    key = (po_key, item_no_norm)
+                    debug_steps.append(f"PO key='{po_key}', lookup key={key!r}")
+
+                    def as_float(s: str) -> Optional[float]:
+                        try:
+                            return float(str(s).replace(",", "").strip())
+                        except Exception:
+                            return None
+
+                    pdf_unit_price_val = as_float(unit_price)
+                    pdf_qty_val = None
                     try:
-                        return float(str(s).replace(",", "").strip())
+                        pdf_qty_val = float(str(qty).replace(",", "").strip())
                     except Exception:
-                        return None
-
-                pdf_unit_price_val = as_float(unit_price)
-                pdf_qty_val = None
-                try:
-                    pdf_qty_val = float(str(qty).replace(",", "").strip())
-                except Exception:
-                    pdf_qty_val = None
+                        pdf_qty_val = None
 
-                debug_steps.append(f"Parsed numeric: pdf_unit_price_val={pdf_unit_price_val} pdf_qty_val={pdf_qty_val}")
+                    debug_steps.append(f"Parsed numeric: pdf_unit_price_val={pdf_unit_price_val} pdf_qty_val={pdf_qty_val}")
 
-                # Build candidate lists from supplier_index (exact or flexible)
-                exact_entries = (supplier_index.get(key, []) if supplier_index else [])
-                debug_steps.append(f"Exact matches from supplier_index for key {key}: count={len(exact_entries)}")
-                if exact_entries:
-                    for i, e in enumerate(exact_entries):
-                        continue
-
-                # Always also gather flex entries (candidates where ksupp startswith/pdf startswith ksupp)
-                flex_entries: List[Tuple[str, str, str, str]] = []
-                if supplier_index:
-                    def po_flex_match(master_po: str, pdf_po: str) -> bool:
-                        return bool(master_po) and bool(pdf_po) and (master_po.startswith(pdf_po) or pdf_po.startswith(master_po))
-                    for (kpo, ksupp), entries in supplier_index.items():
-                        if po_flex_match(kpo, po_key) and (ksupp.startswith(item_no_norm) or item_no_norm.startswith(ksupp)):
-                            flex_entries.extend(entries)
-                    debug_steps.append(f"Flexible matches found: count={len(flex_entries)}")
-                    if flex_entries:
-                        for i, e in enumerate(flex_entries):
+                    # Build candidate lists from supplier_index (exact or flexible)
+                    exact_entries = (supplier_index.get(key, []) if supplier_index else [])
+                    debug_steps.append(f"Exact matches from supplier_index for key {key}: count={len(exact_entries)}")
+                    if exact_entries:
+                        for i, e in enumerate(exact_entries):
                             continue
 
-                # Combine exact and flex candidates (dedupe) so we don't miss close variants like 210-BDUK-LCA
-                if exact_entries:
-                    seen = set(exact_entries)
-                    supplier_candidates = list(exact_entries) + [e for e in flex_entries if e not in seen]
-                else:
-                    supplier_candidates = flex_entries
-
-                total_supplier_matches = len(supplier_candidates)
-                matching_mode = "exact" if exact_entries else ("flex" if flex_entries else "none")
-                debug_steps.append(f"Using supplier_candidates count={total_supplier_matches} mode={matching_mode}")
-                if total_supplier_matches == 1:
-                    # Case A
-                    mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = supplier_candidates[0]
-                    out_orion_item_code = mapped_item_code
-                    status = "A_single"
-                    highlight = "none"
-                    debug_steps.append("Case A: Single supplier match -> use mapped_item_code/mapped_item_desc")
-                    matched_by = "supplier-exact" if matching_mode == "exact" else "supplier-flex"
-                    chosen_orion_code_minimal = mapped_item_code
-                elif total_supplier_matches > 1:
-                    # Case B
-                    debug_steps.append("Case B: multiple supplier candidates, computing price matches")
-                    price_matched = []
-                    if pdf_unit_price_val is not None:
-                        for e in supplier_candidates:
-                            # entries are (orion, pi_desc, unit_rate, qty)
-                            e_price = as_float(e[2])  # unit_rate
-                            e_qty = as_float(e[3])    # qty
-                            debug_steps.append(f"  candidate e={e!r} parsed_price={e_price} parsed_qty={e_qty}")
-                            if e_price is not None and e_price == pdf_unit_price_val:
-                                price_matched.append(e)
-                    debug_steps.append(f"price_matched count={len(price_matched)} list={[p for p in price_matched]}")
-
-                    if len(price_matched) == 1:
-                        mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = price_matched[0]
-                        out_orion_item_code = mapped_item_code
-                        mapped_item_code = ""
-                        mapped_item_desc = ""
-                        status = "B_price_single"
-                        highlight = "yellow"
-                        debug_steps.append("Price match success: exactly 1 price_matched -> output U/V/W")
-                        matched_by = "supplier-" + matching_mode + "+price"
-                        chosen_orion_code_minimal = out_orion_item_code
+                    # Always also gather flex entries (candidates where ksupp startswith/pdf startswith ksupp)
+                    flex_entries: List[Tuple[str, str, str, str]] = []
+                    if supplier_index:
+                        flex_entries = flex_index.match(item_no_norm)
+                        debug_steps.append(f"Flexible matches found: count={len(flex_entries)}")
+                        if flex_entries:
+                            for i, e in enumerate(flex_entries):
+                                continue
+
+                    # Combine exact and flex candidates (dedupe) so we don't miss close variants like 210-BDUK-LCA
+                    if exact_entries:
+                        seen = set(exact_entries)
+                        supplier_candidates = list(exact_entries) + [e for e in flex_entries if e not in seen]
                     else:
-                        # Deterministic qty tie-breaker: only accept an exact qty match.
-                        debug_steps.append("Multiple or zero price matches -> try exact qty tie-breaker")
-                        picked = None
-                        # 1) look for first exact qty among price_matched
-                        if pdf_qty_val is not None and price_matched:
-                            for i_e, e in enumerate(price_matched):
-                                try:
-                                    e_qty = float(str(e[3]).replace(",", "").strip()) if e[3] not in (None, "") else None
-                                except Exception:
-                                    e_qty = None
-                                debug_steps.append(f"  checking price_matched[{i_e}] qty={e_qty} against pdf_qty={pdf_qty_val}")
-                                if e_qty is not None and e_qty == pdf_qty_val:
-                                    picked = e
-                                    debug_steps.append(f"  -> picked exact qty among price_matched at index {i_e}: {e!r}")
-                                    break
-
-                        # 2) if not found, look for first exact qty among all supplier_candidates where price is within small tolerance
-                        if picked is None and pdf_qty_val is not None and supplier_candidates:
-                            TOL = 0.01
-                            debug_steps.append(f"  No exact qty in price_matched; searching all supplier_candidates with tolerance={TOL}")
-                            for i_e, e in enumerate(supplier_candidates):
-                                try:
-                                    e_price = float(str(e[2]).replace(",", "").strip()) if e[2] not in (None, "") else None
-                                    e_qty = float(str(e[3]).replace(",", "").strip()) if e[3] not in (None, "") else None
-                                except Exception:
-                                    e_price = None
-                                    e_qty = None
-                                debug_steps.append(f"    checking supplier_candidates[{i_e}] price={e_price} qty={e_qty}")
-                                if e_qty is not None and e_qty == pdf_qty_val and e_price is not None and pdf_unit_price_val is not None and abs(e_price - pdf_unit_price_val) <= TOL:
-                                    picked = e
-                                    debug_steps.append(f"    -> picked exact qty with tolerant price at index {i_e}: {e!r}")
-                                    break
-
-                        if picked is not None:
-                            mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = picked
+                        supplier_candidates = flex_entries
+
+                    total_supplier_matches = len(supplier_candidates)
+                    matching_mode = "exact" if exact_entries else ("flex" if flex_entries else "none")
+                    debug_steps.append(f"Using supplier_candidates count={total_supplier_matches} mode={matching_mode}")
+                    if total_supplier_matches == 1:
+                        # Case A
+                        mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = supplier_candidates[0]
+                        out_orion_item_code = mapped_item_code
+                        status = "A_single"
+                        highlight = "none"
+                        debug_steps.append("Case A: Single supplier match -> use mapped_item_code/mapped_item_desc")
+                        matched_by = "supplier-exact" if matching_mode == "exact" else "supplier-flex"
+                        chosen_orion_code_minimal = mapped_item_code
+                    elif total_supplier_matches > 1:
+                        # Case B
+                        debug_steps.append("Case B: multiple supplier candidates, computing price matches")
+                        price_matched = []
+                        if pdf_unit_price_val is not None:
+                            for e in supplier_candidates:
+                                # entries are (orion, pi_desc, unit_rate, qty)
+                                e_price = as_float(e[2])  # unit_rate
+                                e_qty = as_float(e[3])    # qty
+                                debug_steps.append(f"  candidate e={e!r} parsed_price={e_price} parsed_qty={e_qty}")
+                                if e_price is not None and e_price == pdf_unit_price_val:
+                                    price_matched.append(e)
+                        debug_steps.append(f"price_matched count={len(price_matched)} list={[p for p in price_matched]}")
+
+                        if len(price_matched) == 1:
+                            mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = price_matched[0]
                             out_orion_item_code = mapped_item_code
                             mapped_item_code = ""
                             mapped_item_desc = ""
-                            status = "B_price_qty_first"
-                            highlight = "none"
-                            debug_steps.append("Qty tie-break: exact qty found -> output U/V/W (no highlight)")
-                            matched_by = "supplier-" + matching_mode + "+price+qty_first"
+                            status = "B_price_single"
+                            highlight = "yellow"
+                            debug_steps.append("Price match success: exactly 1 price_matched -> output U/V/W")
+                            matched_by = "supplier-" + matching_mode + "+price"
                             chosen_orion_code_minimal = out_orion_item_code
                         else:
-                            # STOP: no exact qty -> mark ambiguous, do NOT use closest-qty fallback
-                            status = "B_multi_price_matches"
-                            highlight = "yellow"
-                            mapped_item_code = ""
-                            mapped_item_desc = ""
-                            debug_steps.append("No exact qty found -> Ambiguous price matches -> STOP and mark yellow (no UVW output)")
-                else:
-                    # Case C - no supplier match
-                    highlight = "red"
-                    status = "C_no_supplier_match"
-                    debug_steps.append("Case C: No supplier match -> Highlight M/N red. Try Orion code + price.")
-                    # Try by Orion item code + price
-                    okey = (po_key, item_no_norm)
-                    o_candidates = orion_index.get(okey, []) if orion_index else []
-                    debug_steps.append(f"Orion candidates for key {okey}: count={len(o_candidates)}")
-                    if o_candidates:
-                        for i_e, e in enumerate(o_candidates):
-                            debug_steps.append(f"  orion_candidate[{i_e}]={e!r} parsed_price={as_float(e[2])} parsed_qty={as_float(e[3])}")
-                    price_matched = [e for e in o_candidates if pdf_unit_price_val is not None and as_float(e[2]) == pdf_unit_price_val]
-                    debug_steps.append(f"Orion price_matched count={len(price_matched)}")
-                    if len(price_matched) == 1:
-                        e = price_matched[0]
-                        out_orion_unit_price = e[2]
-                        out_orion_qty = e[3]
-                        out_orion_item_code = e[0]
-                        mapped_item_code = ""
-                        mapped_item_desc = ""
-                        status = "C_orion_price_single"
-                        debug_steps.append("Orion+price match success -> output UVW, keep M/N red")
-                        matched_by = "orion+price"
-                        chosen_orion_code_minimal = out_orion_item_code
+                            # Deterministic qty tie-breaker: only accept an exact qty match.
+                            debug_steps.append("Multiple or zero price matches -> try exact qty tie-breaker")
+                            picked = None
+                            # 1) look for first exact qty among price_matched
+                            if pdf_qty_val is not None and price_matched:
+                                for i_e, e in enumerate(price_matched):
+                                    try:
+                                        e_qty = float(str(e[3]).replace(",", "").strip()) if e[3] not in (None, "") else None
+                                    except Exception:
+                                        e_qty = None
+                                    debug_steps.append(f"  checking price_matched[{i_e}] qty={e_qty} against pdf_qty={pdf_qty_val}")
+                                    if e_qty is not None and e_qty == pdf_qty_val:
+                                        picked = e
+                                        debug_steps.append(f"  -> picked exact qty among price_matched at index {i_e}: {e!r}")
+                                        break
+
+                            # 2) if not found, look for first exact qty among all supplier_candidates where price is within small tolerance
+                            if picked is None and pdf_qty_val is not None and supplier_candidates:
+                                TOL = 0.01
+                                debug_steps.append(f"  No exact qty in price_matched; searching all supplier_candidates with tolerance={TOL}")
+                                for i_e, e in enumerate(supplier_candidates):
+                                    try:
+                                        e_price = float(str(e[2]).replace(",", "").strip()) if e[2] not in (None, "") else None
+                                        e_qty = float(str(e[3]).replace(",", "").strip()) if e[3] not in (None, "") else None
+                                    except Exception:
+                                        e_price = None
+                                        e_qty = None
+                                    debug_steps.append(f"    checking supplier_candidates[{i_e}] price={e_price} qty={e_qty}")
+                                    if e_qty is not None and e_qty == pdf_qty_val and e_price is not None and pdf_unit_price_val is not None and abs(e_price - pdf_unit_price_val) <= TOL:
+                                        picked = e
+                                        debug_steps.append(f"    -> picked exact qty with tolerant price at index {i_e}: {e!r}")
+                                        break
+
+                            if picked is not None:
+                                mapped_item_code, mapped_item_desc, out_orion_unit_price, out_orion_qty = picked
+                                out_orion_item_code = mapped_item_code
+                                mapped_item_code = ""
+                                mapped_item_desc = ""
+                                status = "B_price_qty_first"
+                                highlight = "none"
+                                debug_steps.append("Qty tie-break: exact qty found -> output U/V/W (no highlight)")
+                                matched_by = "supplier-" + matching_mode + "+price+qty_first"
+                                chosen_orion_code_minimal = out_orion_item_code
+                            else:
+                                # STOP: no exact qty -> mark ambiguous, do NOT use closest-qty fallback
+                                status = "B_multi_price_matches"
+                                highlight = "yellow"
+                                mapped_item_code = ""
+                                mapped_item_desc = ""
+                                debug_steps.append("No exact qty found -> Ambiguous price matches -> STOP and mark yellow (no UVW output)")
                     else:
-                        # New fallback: PO + price (ignore item codes)
-                        po_candidates = po_price_index.get(po_key, []) if po_price_index else []
-                        debug_steps.append(f"PO price candidates for PO {po_key}: count={len(po_candidates)}")
-                        po_price_matched = [e for e in po_candidates if pdf_unit_price_val is not None and as_float(e[2]) == pdf_unit_price_val]
-                        debug_steps.append(f"PO+price matched count={len(po_price_matched)}")
-                        if len(po_price_matched) == 1:
-                            e = po_price_matched[0]
+                        # Case C - no supplier match
+                        highlight = "red"
+                        status = "C_no_supplier_match"
+                        debug_steps.append("Case C: No supplier match -> Highlight M/N red. Try Orion code + price.")
+                        # Try by Orion item code + price
+                        okey = (po_key, item_no_norm)
+                        o_candidates = orion_index.get(okey, []) if orion_index else []
+                        debug_steps.append(f"Orion candidates for key {okey}: count={len(o_candidates)}")
+                        if o_candidates:
+                            for i_e, e in enumerate(o_candidates):
+                                debug_steps.append(f"  orion_candidate[{i_e}]={e!r} parsed_price={as_float(e[2])} parsed_qty={as_float(e[3])}")
+                        price_matched = [e for e in o_candidates if pdf_unit_price_val is not None and as_float(e[2]) == pdf_unit_price_val]
+                        debug_steps.append(f"Orion price_matched count={len(price_matched)}")
+                        if len(price_matched) == 1:
+                            e = price_matched[0]
                             out_orion_unit_price = e[2]
                             out_orion_qty = e[3]
                             out_orion_item_code = e[0]
                             mapped_item_code = ""
                             mapped_item_desc = ""
-                            status = "C_po_price_single"
-                            matched_by = "po+price"
+                            status = "C_orion_price_single"
+                            debug_steps.append("Orion+price match success -> output UVW, keep M/N red")
+                            matched_by = "orion+price"
                             chosen_orion_code_minimal = out_orion_item_code
-                            debug_steps.append("PO+price match success -> output UVW, keep M/N red")
                         else:
-                            status = "C_no_price_or_multi" if len(price_matched) != 1 else status
-                            if len(po_price_matched) == 0:
-                                debug_steps.append("PO+price match failure: 0 matches -> Keep red highlight; no output")
+                            # New fallback: PO + price (ignore item codes)
+                            po_candidates = po_price_index.get(po_key, []) if po_price_index else []
+                            debug_steps.append(f"PO price candidates for PO {po_key}: count={len(po_candidates)}")
+                            po_price_matched = [e for e in po_candidates if pdf_unit_price_val is not None and as_float(e[2]) == pdf_unit_price_val]
+                            debug_steps.append(f"PO+price matched count={len(po_price_matched)}")
+                            if len(po_price_matched) == 1:
+                                e = po_price_matched[0]
+                                out_orion_unit_price = e[2]
+                                out_orion_qty = e[3]
+                                out_orion_item_code = e[0]
+                                mapped_item_code = ""
+                                mapped_item_desc = ""
+                                status = "C_po_price_single"
+                                matched_by = "po+price"
+                                chosen_orion_code_minimal = out_orion_item_code
+                                debug_steps.append("PO+price match success -> output UVW, keep M/N red")
                             else:
-                                debug_steps.append(f"PO+price ambiguous: {len(po_price_matched)} matches -> Keep red highlight; no output")
-
-            # Always attach diagnostics entry with the very verbose message
-            if diagnostics is not None:
-                fill_MN = bool(mapped_item_code or mapped_item_desc)
-                fill_UVW = bool(out_orion_item_code or out_orion_unit_price or out_orion_qty)
-                diagnostics.append({
-                    "item_index": idx_item,
-                    "po": po_key if 'po_key' in locals() else "",
-                    "supplier_item_code": item_no_norm,
-                    "pdf_unit_price": unit_price,
-                    "pdf_unit_price_num": (pdf_unit_price_val if 'pdf_unit_price_val' in locals() else ""),
-                    "pdf_qty_num": (pdf_qty_val if 'pdf_qty_val' in locals() else ""),
-                    "status": status,
-                    "highlight": highlight,
-                    "mapped_item_code": mapped_item_code,
-                    "mapped_item_desc": mapped_item_desc,
-                    "out_orion_unit_price": out_orion_unit_price,
-                    "out_orion_qty": out_orion_qty,
-                    "out_orion_item_code": out_orion_item_code,
-                    "total_supplier_matches": total_supplier_matches if 'total_supplier_matches' in locals() else 0,
-                    "matching_mode": matching_mode if 'matching_mode' in locals() else "none",
-                    "supplier_candidate_rates": ", ".join([str(e[2] or "") for e in supplier_candidates]) if 'supplier_candidates' in locals() and supplier_candidates else "",
-                    "price_match_count": (len(price_matched) if 'price_matched' in locals() else 0),
-                    "orion_candidate_count": (len(o_candidates) if 'o_candidates' in locals() and o_candidates is not None else 0),
-                    "fill_MN": fill_MN,
-                    "fill_UVW": fill_UVW,
-                    "message": " | ".join(debug_steps),
-                })
-
-            # Print debug to console (live) for immediate inspection
-            try:
-                print(f"DEBUG-DIAG: build_pre_alert_rows item_index={idx_item}", flush=True)
-                for m in debug_steps:
-                    print("DEBUG-DIAG:", m, flush=True)
-                print("DEBUG-DIAG: ---- end debug item ----", flush=True)   
+                                status = "C_no_price_or_multi" if len(price_matched) != 1 else status
+                                if len(po_price_matched) == 0:
+                                    debug_steps.append("PO+price match failure: 0 matches -> Keep red highlight; no output")
+                                else:
+                                    debug_steps.append(f"PO+price ambiguous: {len(po_price_matched)} matches -> Keep red highlight; no output")
+
+                # Always attach diagnostics entry with the very verbose message
+                if diagnostics is not None:
+                    fill_MN = bool(mapped_item_code or mapped_item_desc)
+                    fill_UVW = bool(out_orion_item_code or out_orion_unit_price or out_orion_qty)
+                    diagnostics.append({
+                        "item_index": idx_item,
+                        "po": po_key if 'po_key' in locals() else "",
+                        "supplier_item_code": item_no_norm,
+                        "pdf_unit_price": unit_price,
+                        "pdf_unit_price_num": (pdf_unit_price_val if 'pdf_unit_price_val' in locals() else ""),
+                        "pdf_qty_num": (pdf_qty_val if 'pdf_qty_val' in locals() else ""),
+                        "status": status,
+                        "highlight": highlight,
+                        "mapped_item_code": mapped_item_code,
+                        "mapped_item_desc": mapped_item_desc,
+                        "out_orion_unit_price": out_orion_unit_price,
+                        "out_orion_qty": out_orion_qty,
+                        "out_orion_item_code": out_orion_item_code,
+                        "total_supplier_matches": total_supplier_matches if 'total_supplier_matches' in locals() else 0,
+                        "matching_mode": matching_mode if 'matching_mode' in locals() else "none",
+                        "supplier_candidate_rates": ", ".join([str(e[2] or "") for e in supplier_candidates]) if 'supplier_candidates' in locals() and supplier_candidates else "",
+                        "price_match_count": (len(price_matched) if 'price_matched' in locals() else 0),
+                        "orion_candidate_count": (len(o_candidates) if 'o_candidates' in locals() and o_candidates is not None else 0),
+                        "fill_MN": fill_MN,
+                        "fill_UVW": fill_UVW,
+                        "message": " | ".join(debug_steps),
+                    })
+
+                # Print debug to console (live) for immediate inspection
+                try:
+                    print(f"DEBUG-DIAG: build_pre_alert_rows item_index={idx_item}", flush=True)
+                    for m in debug_steps:
+                        print("DEBUG-DIAG:", m, flush=True)
+                    print("DEBUG-DIAG: ---- end debug item ----", flush=True)   
                
-            except Exception:
-                # avoid crashing on print errors
-                pass
-
-        except Exception as exc:
-            # Ensure one item's exception does not break whole run; log it in diagnostics/console
-            err_msg = f"EXCEPTION processing item idx={idx_item}: {exc}"
-            try:
-                print(err_msg)
-            except Exception:
-                pass
-            if diagnostics is not None:
-                diagnostics.append({"item_index": idx_item, "error": err_msg})
+                except Exception:
+                    # avoid crashing on print errors
+                    pass
 
-        # Build output row (keep same structure)
-        row = [
-            "PO",  # PO Txn Code
-            headers.get("po_number", ""),
-            headers.get("dell_order_no", ""),
-            headers.get("invoice_date", ""),
-            headers.get("customer_no", "") or headers.get("ed_order", "") or headers.get("dell_order_no", ""),
-            ""  ,# AWB per spec
-               today_plus_10,  # Bill of leading date
-            "N/A",  # Shipping Agent
-            "N/A",  # From Port
-            "N/A",  # To Port
-               today_plus_10,  # ETS
-               today_plus_10,  # ETA (kept the same as ETS)
-            mapped_item_code,  # Item Code (internal)
-            mapped_item_desc,  # Item Desc (internal)
-            "NOS",  # UOM
-            qty,
-            unit_price,
-            item_no,
-            desc,
-            headers.get("consolidation_fee_usd", ""),
-            out_orion_unit_price,
-            out_orion_qty,
-            out_orion_item_code,
-            matched_by,
-            chosen_orion_code_minimal,
-        ]
-        rows.append(row)
+            except Exception as exc:
+                # Ensure one item's exception does not break whole run; log it in diagnostics/console
+                err_msg = f"EXCEPTION processing item idx={idx_item}: {exc}"
+                try:
+                    print(err_msg)
+                except Exception:
+                    pass
+                if diagnostics is not None:
+                    diagnostics.append({"item_index": idx_item, "error": err_msg})
+
+            # Build output row (keep same structure)
+            row = row_head + [
+                mapped_item_code,  # Item Code (internal)
+                mapped_item_desc,  # Item Desc (internal)
+                "NOS",  # UOM
+                qty,
+                unit_price,
+                item_no,
+                desc,
+                consolidation_fee,
+                out_orion_unit_price,
+                out_orion_qty,
+                out_orion_item_code,
+                matched_by,
+                chosen_orion_code_minimal,
+            ]
+            rows.append(row)
     return rows
 
 
+# Default worker cap for build_pre_alert_rows_batch; each worker imports pandas/pdfplumber/fitz
+_BATCH_MAX_WORKERS = 4
+# Smallest batch sent to the pool. Spawning the workers costs ~0.75s against ~50ms
+# per (2-3 page) invoice in-process, so 4 workers only pay off from ~20 PDFs up.
+_BATCH_MIN_FILES = 24
+
+# Master mapping for build_pre_alert_rows_batch workers, set once per process by the pool initializer
+_BATCH_MASTER: Dict[str, Any] = {}
+
+# Serializes the process-wide sys.modules["__main__"] swap in _without_main_module
+_MAIN_SWAP_LOCK = threading.Lock()
+
+
+def _init_batch_worker(master: Dict[str, Any]) -> None:
+    _BATCH_MASTER.clear()
+    _BATCH_MASTER.update(master)
+
+
+def _run_pre_alert(
+    pdf_path, tomorrow_date: str, master: Dict[str, Any]
+) -> Tuple[List[List[Any]], List[Dict[str, Any]], Optional[str]]:
+    diagnostics: List[Dict[str, Any]] = []
+    try:
+        rows = build_pre_alert_rows(pdf_path, tomorrow_date, diagnostics=diagnostics, **master)
+    except Exception as exc:
+        # Items are streamed, so a later page can fail after some diagnostics were
+        # added; drop them like the rows, since callers pair diagnostics with rows
+        return [], [], str(exc)
+    return rows, diagnostics, None
+
+
+@contextmanager
+def _without_main_module() -> Iterator[None]:
+    """Stop spawned workers from re-running the ``__main__`` script.
+
+    Under Streamlit, ``__main__`` is app.py itself, and spawn would execute it
+    again in every worker (UI code, Google Sheets login). The batch workers
+    only need this module, so an empty ``__main__`` is installed while the
+    pool starts its processes.
+
+    sys.modules is shared by every thread, so the swap is done under
+    _MAIN_SWAP_LOCK: concurrent batches (one per Streamlit session) take turns
+    and none of them can save another's stub as the "original". Code outside
+    this module is not blocked: Streamlit installs a fresh ``__main__`` for each
+    rerun and executes the script in that module object, not through
+    sys.modules, and the original is only put back if the stub is still
+    installed, so a rerun's replacement made meanwhile is kept.
+    Keep the body short, i.e. just the process start-up.
+    """
+    with _MAIN_SWAP_LOCK:
+        main = sys.modules.get("__main__")
+        stub = types.ModuleType("__main__")
+        sys.modules["__main__"] = stub
+        try:
+            yield
+        finally:
+            if main is not None and sys.modules.get("__main__") is stub:
+                sys.modules["__main__"] = main
+
+
+def _pre_alert_worker(args: Tuple[Any, str]) -> Tuple[List[List[Any]], List[Dict[str, Any]], Optional[str]]:
+    pdf_path, tomorrow_date = args
+    return _run_pre_alert(pdf_path, tomorrow_date, _BATCH_MASTER)
+
+
+def _batch_pool(workers: int, master: Dict[str, Any]) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_batch_worker,
+        initargs=(master,),
+    )
 
 
+def _run_pre_alert_isolated(
+    pdf_path, tomorrow_date: str, master: Dict[str, Any]
+) -> Tuple[List[List[Any]], List[Dict[str, Any]], Optional[str]]:
+    """Process one PDF in a worker process of its own.
+
+    Used for the PDFs left unfinished when a worker died. The PDF may be the
+    one that killed it (e.g. a crash inside PyMuPDF), so it is never retried
+    in the calling process; if it breaks this pool too it is reported as failed.
+    """
+    try:
+        with _batch_pool(1, master) as pool:
+            with _without_main_module():
+                future = pool.submit(_pre_alert_worker, (pdf_path, tomorrow_date))
+            return future.result()
+    except BrokenProcessPool:
+        return [], [], "worker process crashed while parsing this PDF"
+    except Exception as exc:
+        return [], [], str(exc)
+
+
+def build_pre_alert_rows_batch(
+    pdf_paths: List[str],
+    tomorrow_date: str,
+    master_lookup: Optional[Dict[Tuple[str, str], Tuple[str, str]]] = None,
+    supplier_counts: Optional[Dict[Tuple[str, str], int]] = None,
+    orion_counts: Optional[Dict[Tuple[str, str], int]] = None,
+    supplier_index: Optional[Dict[Tuple[str, str], List[Tuple[str, str, str, str]]]] = None,
+    orion_index: Optional[Dict[Tuple[str, str], List[Tuple[str, str, str, str]]]] = None,
+    po_price_index: Optional[Dict[str, List[Tuple[str, str, str, str, str]]]] = None,
+    max_workers: Optional[int] = None,
+) -> List[Tuple[List[List[Any]], List[Dict[str, Any]], Optional[str]]]:
+    """Run build_pre_alert_rows over several PDFs in parallel worker processes.
+
+    The master mapping (plain dicts/lists of strings, so picklable) is sent to
+    each worker once through the pool initializer instead of with every PDF.
+    Workers are spawned, not forked, since the caller is usually the
+    multithreaded Streamlit server; at most ``_BATCH_MAX_WORKERS`` are used
+    unless ``max_workers`` says otherwise. Batches under ``_BATCH_MIN_FILES``
+    PDFs, or with a single worker, are processed in-process one by one.
+    Returns one (rows, diagnostics, error) tuple per path, in pdf_paths order;
+    error is the exception message if that PDF could not be processed, or
+    notes that its worker process crashed. Other pool failures (e.g. the
+    master mapping not pickling) are raised.
+    """
+    master: Dict[str, Any] = {
+        "master_lookup": master_lookup,
+        "supplier_counts": supplier_counts,
+        "orion_counts": orion_counts,
+        "supplier_index": supplier_index,
+        "orion_index": orion_index,
+        "po_price_index": po_price_index,
+    }
+    workers = max_workers or min(_BATCH_MAX_WORKERS, os.cpu_count() or 1)
+    if workers < 2 or len(pdf_paths) < _BATCH_MIN_FILES:
+        # Small batches finish in-process before a pool would have started
+        return [_run_pre_alert(p, tomorrow_date, master) for p in pdf_paths]
+    results: List[Optional[Tuple[List[List[Any]], List[Dict[str, Any]], Optional[str]]]] = [None] * len(pdf_paths)
+    with _batch_pool(min(workers, len(pdf_paths)), master) as pool:
+        futures = []
+        # Worker processes are started while the tasks are submitted
+        with _without_main_module():
+            for pdf_path in pdf_paths:
+                try:
+                    futures.append(pool.submit(_pre_alert_worker, (pdf_path, tomorrow_date)))
+                except BrokenProcessPool:
+                    break
+        for idx, future in enumerate(futures):
+            try:
+                results[idx] = future.result()
+            except BrokenProcessPool:
+                pass
+    # A dead worker breaks the whole pool and fails every unfinished task, without
+    # saying which PDF killed it; each of those gets a worker of its own instead
+    return [
+        res if res is not None else _run_pre_alert_isolated(pdf_path, tomorrow_date, master)
+        for pdf_path, res in zip(pdf_paths, results)
+    ]